@@ -1,9 +1,28 @@
+import hashlib
 import io
 import re
+import time
+import numpy as np
 import pandas as pd
 import streamlit as st
 from rapidfuzz import process, fuzz
 
+# Compiled once at import; clean_text runs for every brand and description.
+# Kept as separate passes on purpose: re fast-scans for each simple pattern,
+# while a single (a)|(b)|(c) alternation is tried at every position and
+# needs a Python callback per match — measured slower on real descriptions.
+_RE_PAREN = re.compile(r'\([^)]*\)')
+_RE_APOS = re.compile(r"[’'‘`]")
+_RE_SUFFIX = re.compile(r'\b(inc|incorporated|ltd|llc|corp|co|company)\b')
+_RE_PUNCT = re.compile(r'[^\w\s]')
+
+# Upper bound on the uint8 score matrix held at once (rows x brands), ~64 MB
+MAX_SCORE_CELLS = 64 * 1024 * 1024
+
+# Uploads kept per cache below; older ones are evicted so parsed workbooks
+# don't pile up in server memory across users
+CACHE_MAX_ENTRIES = 8
+
 st.set_page_config(page_title="Brand Matcher (Updated)", layout="wide")
 st.title("🧠🔎 Brand Matcher — Updated Version")
 
@@ -30,62 +49,148 @@ with c2:
     brand_file = st.file_uploader("Upload brands Excel", type=["xlsx", "xls"])
 
 def clean_text(text: str) -> str:
-    text = str(text)
-    text = text.lower()
-    text = re.sub(r'\([^)]*\)', '', text)  # remove (...)
-    text = re.sub(r"[’'‘`]", '', text)    # remove apostrophes
-    text = re.sub(r'\b(inc|incorporated|ltd|llc|corp|co|company)\b', '', text)
-    text = re.sub(r'[^\w\s]', ' ', text)   # punctuation → space
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
-
-def clean_brand_name(brand):
-    brand = re.sub(r'\([^)]*\)', '', str(brand))
-    return clean_text(brand).strip()
-
-def brand_in_description(brand, description):
-    desc_clean = clean_text(description)
-    brand_clean = clean_text(brand)
-    return brand_clean in desc_clean  # phrase match
-
-def split_brands(s):
-    pattern = r',\s*(?![^()]*\))'
-    return re.split(pattern, str(s))
-
-def filter_matched_brands(description, matched_brands_str):
-    if pd.isna(matched_brands_str) or str(matched_brands_str).strip() == '':
-        return "no brand found"
-
-    matched_brands_raw = split_brands(matched_brands_str)
-    multi_word_brands = []
-    single_word_flag = False
-
-    for raw_brand in matched_brands_raw:
-        brand = clean_brand_name(raw_brand)
-        brand_tokens = brand.split()
-
-        if len(brand_tokens) == 1:
-            single_word_flag = True
-            continue
-
-        if brand_in_description(brand, description):
-            multi_word_brands.append(raw_brand.strip())
-
-    if multi_word_brands:
-        return ', '.join(multi_word_brands)
-
-    if single_word_flag:
-        return "this is a single word brand"
-
-    return "no brand found"
+    # `text` must already be lowercased; columns are lowercased once with
+    # .str.lower() before reaching here (see clean_column)
+    text = _RE_PAREN.sub('', text)   # remove (...)
+    text = _RE_APOS.sub('', text)    # remove apostrophes
+    text = _RE_SUFFIX.sub('', text)
+    text = _RE_PUNCT.sub(' ', text)  # punctuation → space
+    return ' '.join(text.split())    # collapse whitespace
+
+def clean_column(values: pd.Series) -> np.ndarray:
+    # Column-wise clean_text over a lowercased str column; each distinct
+    # value is cleaned only once
+    codes, uniques = pd.factorize(values)
+    cleaned = np.array([clean_text(u) for u in uniques], dtype=object)
+    return cleaned[codes]
+
+def top_matches(scores, top_n, threshold):
+    # Column indices of the best `top_n` scores >= threshold, best first.
+    # Ties keep the lower index first, same order as process.extract.
+    n = scores.shape[0]
+    if n == 0:
+        return np.empty(0, dtype=np.intp)
+    keys = scores.astype(np.int64) * n - np.arange(n)
+    k = min(top_n, n)
+    idx = np.argpartition(-keys, k - 1)[:k]
+    idx = idx[np.argsort(-keys[idx])]
+    return idx[scores[idx] >= threshold]
+
+def throttled_progress(bar, interval=0.25):
+    # Progress callback that pushes to the browser at most every `interval`
+    # seconds (each st.progress call is a websocket round-trip)
+    last_update = 0.0
+
+    def update(fraction):
+        nonlocal last_update
+        now = time.monotonic()
+        if now - last_update > interval or fraction >= 1.0:
+            bar.progress(min(1.0, fraction))
+            last_update = now
+
+    return update
+
+def match_queries(queries: np.ndarray, cleaned_brands: np.ndarray, threshold: int, top_n: int, on_progress=None) -> np.ndarray:
+    # Top-N brand indices (see top_matches) for every query, as a
+    # (len(queries), top_n) int array padded with -1. Repeated queries are
+    # scored once. Distinct queries go through cdist in row chunks so only a
+    # chunk's score matrix is held in memory; cdist spreads each chunk over
+    # all cores (GIL released).
+    codes, uniques = pd.factorize(queries)
+    matches = np.full((len(uniques), top_n), -1, dtype=np.intp)
+    chunk_rows = max(1, MAX_SCORE_CELLS // max(1, len(cleaned_brands)))
+    for start in range(0, len(uniques), chunk_rows):
+        scores = process.cdist(
+            uniques[start:start + chunk_rows],
+            cleaned_brands,
+            scorer=fuzz.token_set_ratio,
+            score_cutoff=threshold,
+            workers=-1,
+            dtype=np.uint8,
+        )
+        for k, row in enumerate(scores, start=start):
+            idx = top_matches(row, top_n, threshold)
+            matches[k, :len(idx)] = idx
+        if on_progress:
+            on_progress(min(1.0, (start + chunk_rows) / len(uniques)))
+    return matches[codes]
+
+def format_matches(matches, brand_names):
+    # "Brand A, Brand B" per row from the -1 padded index array
+    return [", ".join(brand_names[row[row >= 0]]) for row in matches]
+
+def filter_matched_brands(matches, cleaned_descs, cleaned_brands, brand_word_counts, brand_names):
+    # Stage 2 for all rows: keep matched multi-word brands whose cleaned name
+    # appears in the cleaned description (phrase match)
+    valid = matches >= 0
+    word_counts = np.zeros(matches.shape, dtype=np.intp)
+    word_counts[valid] = brand_word_counts[matches[valid]]
+    has_single_word = (word_counts == 1).any(axis=1)
+
+    # At most top_n plain substring checks per row; an Aho-Corasick scan of
+    # the description instead enumerates every brand in it and is slower here
+    multi_word_brands = [[] for _ in range(len(matches))]
+    for i, j in zip(*np.nonzero(word_counts > 1)):
+        brand = matches[i, j]
+        if cleaned_brands[brand] in cleaned_descs[i]:
+            multi_word_brands[i].append(brand_names[brand])
+
+    filtered = []
+    for i, brands in enumerate(multi_word_brands):
+        if brands:
+            filtered.append(', '.join(brands))
+        elif has_single_word[i]:
+            filtered.append("this is a single word brand")
+        else:
+            filtered.append("no brand found")
+    return filtered
+
+def file_key(data: bytes) -> str:
+    # Content hash of an upload, computed once per run and used as the cache
+    # key below instead of letting Streamlit rehash the raw bytes per call
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def read_excel(key: str, _data: bytes) -> pd.DataFrame:
+    # calamine (Rust) parses much faster than openpyxl and also reads .xls;
+    # fall back to pandas' default engine when python-calamine is missing
+    try:
+        return pd.read_excel(io.BytesIO(_data), engine="calamine")
+    except (ImportError, ValueError):
+        return pd.read_excel(io.BytesIO(_data))
+
+# Cleaning is cached on the uploaded file's key + column, so reruns with the
+# same files skip it. The parsed data is passed as an underscore argument,
+# which Streamlit leaves out of the cache key.
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def prepare_brands(brand_key: str, col: str, _brand_df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Cleaned names, their word counts and the original names, indexed alike
+    brands = _brand_df[col].dropna()
+    cleaned_brands = clean_column(brands.astype(str).str.lower())  # repeated raw names are cleaned once
+    brand_word_counts = np.array([len(b.split()) for b in cleaned_brands], dtype=np.intp)
+    return cleaned_brands, brand_word_counts, brands.astype(str).to_numpy(dtype=object)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def prepare_descriptions(desc_key: str, col: str, _desc_df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Lowercase once for the whole column, then clean column-wise
+    desc_lower = _desc_df[col].fillna("").astype(str).str.lower()
+    has_by = desc_lower.str.contains(" by ", regex=False).to_numpy(dtype=bool)
+    cleaned_descs = clean_column(desc_lower)
+
+    # Query the text after " by " where present, else the whole description
+    primary_queries = cleaned_descs.copy()
+    primary_queries[has_by] = clean_column(desc_lower[has_by].str.split(" by ", n=1).str[1])
+    return has_by, primary_queries, cleaned_descs
 
 # Run button
 run = st.button("▶️ Run Matching", type="primary", disabled=not (desc_file and brand_file))
 
 if run:
+    desc_bytes, brand_bytes = desc_file.getvalue(), brand_file.getvalue()
+    desc_key, brand_key = file_key(desc_bytes), file_key(brand_bytes)
     try:
-        desc_df = pd.read_excel(desc_file)
-        brand_df = pd.read_excel(brand_file)
+        desc_df = read_excel(desc_key, desc_bytes)
+        brand_df = read_excel(brand_key, brand_bytes)
     except Exception as e:
         st.error(f"Failed to read Excel files: {e}")
         st.stop()
@@ -100,56 +205,35 @@ if run:
     if "data_key" not in desc_df.columns:
         st.warning("No 'data_key' column found. Will continue without it.")
 
-    # Clean brand list
-    brand_df = brand_df.dropna(subset=["Brand"])
-    cleaned_brands = [clean_text(b) for b in brand_df["Brand"]]
-    cleaned_to_original = dict(zip(cleaned_brands, brand_df["Brand"]))
+    # Clean brand list and descriptions (cached across reruns)
+    cleaned_brands, brand_word_counts, brand_names = prepare_brands(brand_key, "Brand", brand_df)
+    has_by, primary_queries, cleaned_descs = prepare_descriptions(desc_key, "Description", desc_df)
+
+    threshold = int(similarity_threshold)
 
-    matched_brands_per_description = []
     prog = st.progress(0)
-    total = len(desc_df)
+    update_progress = throttled_progress(prog)
 
-    for i, desc in enumerate(desc_df["Description"].astype(str)):
-        desc_lower = desc.lower()
+    # Score every description against every brand
+    matches = match_queries(
+        primary_queries, cleaned_brands, threshold, int(top_n),
+        on_progress=lambda f: update_progress(0.6 * f),
+    )
 
-        if " by " in desc_lower:
-            after_by = desc_lower.split(" by ", 1)[1]
-            query = clean_text(after_by)
-        else:
-            query = clean_text(desc)
+    # fallback if none matched after "by": rescore only those rows on the full description
+    need_fallback = has_by & (matches[:, 0] < 0)
+    matches[need_fallback] = match_queries(
+        cleaned_descs[need_fallback], cleaned_brands, threshold, int(top_n),
+        on_progress=lambda f: update_progress(0.6 + 0.3 * f),
+    )
+    update_progress(0.9)
 
-        results = process.extract(
-            query=query,
-            choices=cleaned_brands,
-            scorer=fuzz.token_set_ratio,
-            limit=int(top_n),
-        )
-        filtered_matches = [cleaned_to_original[m[0]] for m in results if m[1] >= int(similarity_threshold)]
-
-        # fallback if none matched after "by"
-        if not filtered_matches and " by " in desc_lower:
-            query2 = clean_text(desc)
-            results2 = process.extract(
-                query=query2,
-                choices=cleaned_brands,
-                scorer=fuzz.token_set_ratio,
-                limit=int(top_n),
-            )
-            filtered_matches = [cleaned_to_original[m[0]] for m in results2 if m[1] >= int(similarity_threshold)]
-
-        matched_brands_per_description.append(", ".join(filtered_matches))
-
-        if (i + 1) % max(1, total // 100) == 0:
-            prog.progress(min(1.0, (i + 1) / total))
-
-    # Add matches
-    desc_df["Matched_Brands"] = matched_brands_per_description
-
-    # Filter matches (Stage 2)
-    desc_df["Filtered_Brands"] = desc_df.apply(
-        lambda row: filter_matched_brands(row["Description"], row["Matched_Brands"]),
-        axis=1
+    # Filter matches (Stage 2) on brand indices; names are only joined for output
+    desc_df["Filtered_Brands"] = filter_matched_brands(
+        matches, cleaned_descs, cleaned_brands, brand_word_counts, brand_names
     )
+    desc_df["Matched_Brands"] = format_matches(matches, brand_names)
+    prog.progress(1.0)
 
     # Reorder columns
     if "data_key" in desc_df.columns:
@@ -161,17 +245,27 @@ if run:
     st.subheader("Results Preview (first 200 rows)")
     st.dataframe(out_df.head(200), use_container_width=True)
 
-    # Download
+    # Download (xlsxwriter streams rows out instead of building an openpyxl workbook)
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
         out_df.to_excel(writer, index=False, sheet_name="matches")
     output.seek(0)
 
-    st.download_button(
-        label="⬇️ Download Excel results",
-        data=output,
-        file_name="brand_match_results_filtered_with_key.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
+    d1, d2 = st.columns(2)
+    with d1:
+        st.download_button(
+            label="⬇️ Download Excel results",
+            data=output,
+            file_name="brand_match_results_filtered_with_key.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+    with d2:
+        # CSV is much faster to write for large outputs; BOM so Excel reads UTF-8
+        st.download_button(
+            label="⬇️ Download CSV results",
+            data=out_df.to_csv(index=False).encode("utf-8-sig"),
+            file_name="brand_match_results_filtered_with_key.csv",
+            mime="text/csv",
+        )
 
 st.caption("Tip: If you see missing matches, lower the threshold or increase Top N.")
@@ -1,6 +1,13 @@
-import json, ast, io, contextlib, os
+import json, ast, io, contextlib, os, itertools
 import streamlit as st
 
+# Faster JSON parsing for large notebooks; the stdlib parser works too
+try:
+    import orjson
+    _json_loads = orjson.loads
+except Exception:
+    _json_loads = json.loads
+
 # Optional but commonly needed
 try:
     import pandas as pd  # for nicer display of DataFrames if present
@@ -25,7 +32,7 @@ uploaded = st.file_uploader("Upload your .ipynb (optional)", type=["ipynb"])
 
 def read_notebook_bytes(b):
     try:
-        nb = json.loads(b.decode("utf-8"))
+        nb = _json_loads(b)
         return nb
     except Exception as e:
         st.error(f"Could not parse notebook JSON: {e}")
@@ -33,8 +40,8 @@ def read_notebook_bytes(b):
 
 def read_notebook_path(path):
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return _json_loads(f.read())
     except Exception as e:
         st.error(f"Could not read notebook at '{path}': {e}")
         return None
@@ -47,15 +54,24 @@ else:
 if not nb:
     st.stop()
 
-# Extract code cells
-cells = []
-for cell in nb.get("cells", []):
-    if cell.get("cell_type") == "code":
-        src = "".join(cell.get("source", ""))
-        if src.strip():
-            cells.append(src)
+# Code cells are read from the notebook lazily; only their count is kept up front
+def _is_code_cell(cell):
+    # Code cell with any non-whitespace source (source is a str or list of lines)
+    source = cell.get("source", "")
+    if isinstance(source, str):
+        source = [source]
+    return cell.get("cell_type") == "code" and any(line.strip() for line in source)
+
+def iter_code_cells(nb):
+    return ("".join(cell.get("source", "")) for cell in nb.get("cells", []) if _is_code_cell(cell))
 
-if not cells:
+def get_cell(nb, idx):
+    # Source of the idx-th (0-based) code cell
+    return next(itertools.islice(iter_code_cells(nb), idx, None))
+
+n_cells = sum(1 for cell in nb.get("cells", []) if _is_code_cell(cell))
+
+if not n_cells:
     st.warning("No code cells were found in the notebook.")
     st.stop()
 
@@ -64,7 +80,7 @@ run_all = st.sidebar.button("▶️ Run all cells")
 reset_state = st.sidebar.button("🔄 Reset runtime")
 selected_idx = st.sidebar.multiselect(
     "Run selected cells (by index)",
-    options=list(range(1, len(cells) + 1)),
+    options=list(range(1, n_cells + 1)),
     default=[]
 )
 
@@ -82,6 +98,19 @@ if reset_state or "exec_env" not in st.session_state:
     if pd:
         st.session_state.exec_env["pd"] = pd
 
+@st.cache_resource(show_spinner=False)
+def compile_cell(cell_code: str):
+    # Parse + compile once per distinct cell source (Streamlit re-executes this
+    # script on every rerun, so a plain module-level dict would not survive)
+    tree = ast.parse(cell_code, mode="exec")
+    last_is_expr = len(tree.body) > 0 and isinstance(tree.body[-1], ast.Expr)
+    if last_is_expr:
+        # Separate last expression for eval to show its value like in notebooks
+        last_expr = ast.Expression(body=tree.body[-1].value)
+        tree.body = tree.body[:-1]
+        return compile(tree, "<cell>", "exec"), compile(last_expr, "<cell-expr>", "eval")
+    return compile(tree, "<cell>", "exec"), None
+
 def run_cell(cell_code: str):
     # Display code
     with st.expander("Show code", expanded=False):
@@ -93,19 +122,13 @@ def run_cell(cell_code: str):
     # Capture stdout
     buf = io.StringIO()
     try:
-        tree = ast.parse(cell_code, mode="exec")
-        last_is_expr = len(tree.body) > 0 and isinstance(tree.body[-1], ast.Expr)
-        if last_is_expr:
-            # Separate last expression for eval to show its value like in notebooks
-            last_expr = ast.Expression(body=tree.body[-1].value)
-            tree.body = tree.body[:-1]
-            code_without_last = compile(tree, "<cell>", "exec")
-            last_code = compile(last_expr, "<cell-expr>", "eval")
-            with contextlib.redirect_stdout(buf):
-                exec(code_without_last, env)
-            stdout = buf.getvalue()
-            if stdout:
-                st.text(stdout)
+        code_without_last, last_code = compile_cell(cell_code)
+        with contextlib.redirect_stdout(buf):
+            exec(code_without_last, env)
+        stdout = buf.getvalue()
+        if stdout:
+            st.text(stdout)
+        if last_code is not None:
             result = eval(last_code, env)
             # Display nicely
             try:
@@ -115,27 +138,20 @@ def run_cell(cell_code: str):
                     st.write(result)
             except Exception:
                 st.write(result)
-        else:
-            code_obj = compile(tree, "<cell>", "exec")
-            with contextlib.redirect_stdout(buf):
-                exec(code_obj, env)
-            stdout = buf.getvalue()
-            if stdout:
-                st.text(stdout)
     except Exception as e:
         st.exception(e)
 
 # UI: choose to run all or selected
 if run_all:
-    for i, src in enumerate(cells, start=1):
+    for i, src in enumerate(iter_code_cells(nb), start=1):
         st.subheader(f"Cell {i}")
         run_cell(src)
 elif selected_idx:
     for i in selected_idx:
         idx = int(i) - 1
-        if 0 <= idx < len(cells):
+        if 0 <= idx < n_cells:
             st.subheader(f"Cell {i}")
-            run_cell(cells[idx])
+            run_cell(get_cell(nb, idx))
 else:
     st.info("Use **Run all cells** or pick specific cells from the sidebar to execute.")
 